@@ -2,12 +2,21 @@ import os
 import json
 import random
 import time
+import tempfile
+import hashlib
+import functools
+import threading
+import multiprocessing
+import concurrent.futures
 from typing import List, Dict, Optional
 from typing import List, Dict, Optional
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from dotenv import load_dotenv
-from unstructured.partition.pdf import partition_pdf
+from pypdf import PdfReader, PdfWriter
+from file_utils import atomic_write_json, atomic_write_text
+from json_utils import strip_fences
+from pdf_worker import init_worker, partition_pdf_text
+import db
 
 load_dotenv(override=True)
 
@@ -15,50 +24,194 @@ load_dotenv(override=True)
 UPLOAD_ROOT = "uploads"
 DATA_ROOT = "data"
 ASSESSMENT_DIR = os.path.join(DATA_ROOT, "assessments")
-PROGRESS_FILE = os.path.join(DATA_ROOT, "user_progress.json")
+PROGRESS_DIR = os.path.join(DATA_ROOT, "progress") # Pre-SQLite per-session files, imported by migrate_data.py
+TEXT_CACHE_DIR = os.path.join(DATA_ROOT, "text_cache")
+LEGACY_PROGRESS_FILE = os.path.join(DATA_ROOT, "user_progress.json")
 COOLDOWN_SECONDS = 600 # 10 Minutes
+LLM_TEMPERATURE = 0.3
+SESSION_TEXT_LIMIT = 50000 # Max characters of session text sent to the LLM
+PAGES_PER_CHUNK = 20 # Large PDFs are split into page ranges and partitioned in parallel
 
 os.makedirs(ASSESSMENT_DIR, exist_ok=True)
+os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
 
-# Initialize Gemini
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.3)
+@functools.lru_cache(maxsize=1)
+def get_llm():
+    """Initializes Gemini on first use so importing this module stays cheap."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=LLM_TEMPERATURE)
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+def get_pdf_executor() -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Shared worker pool for PDF partitioning, created on first use and kept for the
+    life of the process so workers import unstructured only once. Workers are
+    spawned, never forked: forking the threaded server process is unsafe.
+    """
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker
+            )
+        return _pdf_executor
+
+def reset_pdf_executor(executor: concurrent.futures.ProcessPoolExecutor):
+    """Drops a broken pool (e.g. a worker crashed) so the next call starts a fresh one."""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is executor:
+            _pdf_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def text_cache_path(file_path: str) -> str:
+    """Cache location for a PDF's extracted text; changes whenever the file is modified."""
+    st = os.stat(file_path)
+    key = hashlib.sha1(f"{os.path.abspath(file_path)}:{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()
+    return os.path.join(TEXT_CACHE_DIR, key + ".txt")
+
+def read_text_cache(cache_path: str) -> Optional[str]:
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def write_text_cache(cache_path: str, text: str):
+    # Failed extractions come back empty; don't pin them in the cache
+    if text:
+        atomic_write_text(cache_path, text)
+
+def split_pdf(file_path: str, out_dir: str, prefix: str) -> List[str]:
+    """Splits a PDF into PAGES_PER_CHUNK page ranges written to out_dir. Small PDFs are returned as-is."""
+    try:
+        reader = PdfReader(file_path)
+        num_pages = len(reader.pages)
+    except Exception as e:
+        print(f"Could not split {os.path.basename(file_path)}, partitioning whole file: {e}")
+        return [file_path]
+
+    if num_pages <= PAGES_PER_CHUNK:
+        return [file_path]
+
+    chunk_paths = []
+    for start in range(0, num_pages, PAGES_PER_CHUNK):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + PAGES_PER_CHUNK]:
+            writer.add_page(page)
+        chunk_path = os.path.join(out_dir, f"{prefix}_{start}.pdf")
+        with open(chunk_path, "wb") as f:
+            writer.write(f)
+        chunk_paths.append(chunk_path)
+    return chunk_paths
+
+def fair_share_limits(lengths: List[int], budget: int) -> List[int]:
+    """
+    Splits a character budget across texts so one huge file can't crowd out the rest.
+    Texts shorter than their share keep everything and pass the leftover on.
+    """
+    limits = [0] * len(lengths)
+    remaining = budget
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    for n, i in enumerate(order):
+        share = remaining // (len(order) - n)
+        limits[i] = min(lengths[i], share)
+        remaining -= limits[i]
+    return limits
+
+def partition_files(file_paths: List[str]) -> List[str]:
+    """
+    Returns the text of each PDF, in order. Large PDFs are split into page ranges
+    and all ranges are partitioned in parallel on the shared worker pool.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_chunks = [split_pdf(path, tmp_dir, str(idx)) for idx, path in enumerate(file_paths)]
+        chunk_paths = [chunk for chunks in file_chunks for chunk in chunks]
+
+        executor = get_pdf_executor()
+        try:
+            chunk_texts = list(executor.map(partition_pdf_text, chunk_paths))
+        except concurrent.futures.process.BrokenProcessPool:
+            reset_pdf_executor(executor)
+            raise
+
+    # Reassemble in original file / page order
+    texts = []
+    pos = 0
+    for chunks in file_chunks:
+        texts.append("\n".join(chunk_texts[pos:pos + len(chunks)]))
+        pos += len(chunks)
+    return texts
+
+def cached_partition_text(file_path: str) -> str:
+    """partition_files for one PDF, reusing the stored text while the file is unchanged."""
+    cache_path = text_cache_path(file_path)
+    text = read_text_cache(cache_path)
+    if text is None:
+        text = partition_files([file_path])[0]
+        write_text_cache(cache_path, text)
+    return text
 
 def get_session_text(session_id: str) -> str:
     """
     Extracts text from all PDFs in the session directory.
-    Uses unstructured (fast strategy) for speed.
+    Uses unstructured (fast strategy) for speed, partitioning files (and page
+    ranges of large files) in parallel. Text from unchanged files is served
+    from TEXT_CACHE_DIR.
     """
     session_dir = os.path.join(UPLOAD_ROOT, session_id)
-    if not os.path.exists(session_dir):
+
+    try:
+        with os.scandir(session_dir) as entries:
+            pdf_paths = sorted(entry.path for entry in entries if entry.name.lower().endswith(".pdf"))
+    except FileNotFoundError:
         return ""
 
-    full_text = ""
-    for filename in os.listdir(session_dir):
-        if filename.lower().endswith(".pdf"):
-            file_path = os.path.join(session_dir, filename)
-            try:
-                elements = partition_pdf(filename=file_path, strategy="fast")
-                full_text += "\n".join([str(e) for e in elements])
-            except Exception as e:
-                print(f"Error parsing {filename}: {e}")
-    
-    return full_text[:50000] # Limit context window for safety
+    # Reuse text extracted earlier from unchanged files; only partition the rest
+    parts: List[str] = [""] * len(pdf_paths)
+    misses = []
+    for idx, path in enumerate(pdf_paths):
+        try:
+            cache_path = text_cache_path(path)
+        except FileNotFoundError:
+            continue
+        cached = read_text_cache(cache_path)
+        if cached is None:
+            misses.append((idx, path, cache_path))
+        else:
+            parts[idx] = cached
+
+    if misses:
+        texts = partition_files([path for _, path, _ in misses])
+        for (idx, _, cache_path), text in zip(misses, texts):
+            parts[idx] = text
+            write_text_cache(cache_path, text)
+
+    # Limit context window for safety, sharing the budget fairly between files
+    budget = max(0, SESSION_TEXT_LIMIT - (len(parts) - 1)) # Leave room for the separators
+    limits = fair_share_limits([len(part) for part in parts], budget)
+    return "\n".join(part[:limit] for part, limit in zip(parts, limits))
 
 def get_sorted_files(session_id: str):
     """Returns a list of PDF dictionaries sorted by creation time (Oldest First)."""
     session_dir = os.path.join(UPLOAD_ROOT, session_id)
-    if not os.path.exists(session_dir):
-        return []
     
     files = []
-    for filename in os.listdir(session_dir):
-        if filename.lower().endswith(".pdf"):
-            path = os.path.join(session_dir, filename)
-            files.append({
-                "filename": filename,
-                "path": path,
-                "timestamp": os.path.getctime(path)
-            })
+    try:
+        with os.scandir(session_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(".pdf"):
+                    files.append({
+                        "filename": entry.name,
+                        "path": entry.path,
+                        "timestamp": entry.stat().st_ctime
+                    })
+    except FileNotFoundError:
+        return []
     
     # Sort: Oldest -> Newest
     return sorted(files, key=lambda x: x["timestamp"])
@@ -66,16 +219,14 @@ def get_sorted_files(session_id: str):
 def get_current_chapter_context(session_id: str, chapter_file: dict) -> str:
     """Extracts text ONLY from the specific chapter file."""
     try:
-        from unstructured.partition.pdf import partition_pdf
-        elements = partition_pdf(filename=chapter_file["path"], strategy="fast")
-        return "\n".join([str(e) for e in elements])[:40000]
+        return cached_partition_text(chapter_file["path"])[:40000]
     except Exception as e:
         print(f"Error reading chapter {chapter_file['filename']}: {e}")
         return ""
 
-def get_assessment_prompt(level: int, context: str) -> str:
-    if level == 1:
-        return f"""
+# Prompt templates per level; {context} is filled in at call time
+LEVEL_PROMPTS = {
+    1: """
         You are an educational AI. Create a Level 1 Assessment (Recall & Understanding) based on the text below.
         
         Rules:
@@ -90,19 +241,18 @@ def get_assessment_prompt(level: int, context: str) -> str:
 
         Output JSON format:
         [
-            {{
+            {
                 "id": 1,
                 "question": "What is...",
                 "options": ["A", "B", "C", "D"],
                 "correct_answer": "A",
                 "explanation": "Brief explanation of why A is correct.",
                 "hints": ["Hint 1 (Vague)", "Hint 2 (Helpful)", "Hint 3 (Giveaway)"]
-            }},
+            },
             ...
         ]
-        """
-    elif level == 2:
-        return f"""
+        """,
+    2: """
         You are an educational AI. Create a Level 2 Assessment (Application & Analysis) based on the text below.
         
         Rules:
@@ -117,19 +267,18 @@ def get_assessment_prompt(level: int, context: str) -> str:
 
         Output JSON format:
         [
-            {{
+            {
                 "id": 1,
                 "question": "Scenario...",
                 "options": ["A", "B", "C", "D"],
                 "correct_answer": "B",
                 "explanation": "Brief explanation of why B is correct in this scenario.",
                 "hints": ["Hint 1", "Hint 2", "Hint 3"]
-            }},
+            },
             ...
         ]
-        """
-    elif level == 3:
-        return f"""
+        """,
+    3: """
         You are an educational AI. Create a Level 3 Assessment (Creation & Evaluation) based on the text below.
         
         Rules:
@@ -143,27 +292,36 @@ def get_assessment_prompt(level: int, context: str) -> str:
 
         Output JSON format:
         [
-            {{
+            {
                 "id": 1,
                 "question": "Propose a method to...",
                 "type": "short_answer",
                 "explanation": "Key elements that should be in the student's answer.",
                 "hints": ["Think about...", "Consider...", "Remember the concept of..."]
-            }},
+            },
             ...
         ]
-        """
-    return ""
+        """,
+}
+
+def get_assessment_prompt(level: int, context: str) -> str:
+    template = LEVEL_PROMPTS.get(level)
+    if template is None:
+        return ""
+    # str.replace rather than format(): the context may itself contain braces
+    return template.replace("{context}", context, 1)
 
 def generate_assessment(session_id: str, level: int):
     # 1. Check Cache
     cache_file = os.path.join(ASSESSMENT_DIR, f"{session_id}_lvl{level}.json")
-    if os.path.exists(cache_file):
-        with open(cache_file, "r") as f:
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
             return json.load(f)
+    except FileNotFoundError:
+        pass
 
     # 2. Determine Current Chapter
-    progress = load_user_progress().get(session_id, {})
+    progress = load_user_progress(session_id)
     chapter_index = progress.get("current_chapter_index", 0)
     
     files = get_sorted_files(session_id)
@@ -185,16 +343,8 @@ def generate_assessment(session_id: str, level: int):
     messages = [HumanMessage(content=prompt)]
     
     try:
-        response = llm.invoke(messages)
-        content = response.content.strip()
-        
-        # Clean Markdown
-        if content.startswith("```json"):
-            content = content[7:-3]
-        elif content.startswith("```"):
-            content = content[3:-3]
-            
-        assessment_data = json.loads(content)
+        response = get_llm().invoke(messages)
+        assessment_data = json.loads(strip_fences(response.content))
         
         # Add metadata like timer
         result = {
@@ -205,8 +355,7 @@ def generate_assessment(session_id: str, level: int):
         }
         
         # Save to Cache
-        with open(cache_file, "w") as f:
-            json.dump(result, f, indent=4)
+        atomic_write_json(cache_file, result)
             
         return result
         
@@ -251,11 +400,8 @@ def generate_remedial_plan(mistakes: List[Dict]) -> Dict:
     }}
     """
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        content = response.content.strip()
-        if content.startswith("```json"): content = content[7:-3]
-        elif content.startswith("```"): content = content[3:-3]
-        return json.loads(content)
+        response = get_llm().invoke([HumanMessage(content=prompt)])
+        return json.loads(strip_fences(response.content))
     except Exception as e:
         print(f"Remedial Plan Generation Failed: {e}")
         return {
@@ -266,130 +412,227 @@ def generate_remedial_plan(mistakes: List[Dict]) -> Dict:
 
 def spend_xp(session_id: str, amount: int) -> bool:
     """Deducts XP if sufficient balance exists. Returns True if successful."""
-    progress = load_user_progress()
-    if session_id not in progress:
-        return False
-    
-    if progress[session_id].get("xp", 0) >= amount:
-        progress[session_id]["xp"] -= amount
-        save_user_progress(progress)
-        return True
-    return False
+    with db.connect() as conn:
+        cur = conn.execute(
+            "UPDATE sessions SET xp = xp - ? WHERE session_id = ? AND xp >= ?",
+            (amount, session_id, amount)
+        )
+        return cur.rowcount > 0
+
+def add_xp(session_id: str, amount: int) -> int:
+    """Adds XP (creating the session if needed) and returns the new total."""
+    with db.connect(immediate=True) as conn:
+        conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (session_id,))
+        conn.execute("UPDATE sessions SET xp = xp + ? WHERE session_id = ?", (amount, session_id))
+        return conn.execute("SELECT xp FROM sessions WHERE session_id = ?", (session_id,)).fetchone()["xp"]
 
 def clear_cooldown(session_id: str):
     """Clears the remedial plan and retry cooldown for a session."""
-    progress = load_user_progress()
-    if session_id in progress:
-        user_data = progress[session_id]
-        if "remedial_plan" in user_data:
-            del user_data["remedial_plan"]
-        if "retry_available_at" in user_data:
-            del user_data["retry_available_at"]
-        save_user_progress(progress)
-        return True
-    return False
+    with db.connect() as conn:
+        cur = conn.execute(
+            "UPDATE sessions SET remedial_plan = NULL, retry_available_at = NULL WHERE session_id = ?",
+            (session_id,)
+        )
+        return cur.rowcount > 0
+
+MISTAKE_FIELDS = ["question", "correct_answer", "explanation", "user_answer", "level", "comments", "timestamp"]
+
+def mistake_from_row(row) -> Dict:
+    return {field: row[field] for field in MISTAKE_FIELDS}
+
+def load_user_progress(session_id: str) -> Dict:
+    """Loads one session's progress as a dict. Returns {} if the session has none yet."""
+    with db.connect() as conn:
+        row = conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return {}
+        history = conn.execute(
+            "SELECT level, score, max_score, passed, xp_gained, timestamp FROM history WHERE session_id = ? ORDER BY id",
+            (session_id,)
+        ).fetchall()
+        mistakes = conn.execute(
+            "SELECT * FROM mistakes WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+
+    user_data = {
+        "xp": row["xp"],
+        "unlocked_level": row["unlocked_level"],
+        "current_chapter_index": row["current_chapter_index"],
+        "history": [dict(h, passed=bool(h["passed"])) for h in history],
+        "mistakes": [mistake_from_row(m) for m in mistakes]
+    }
+    if row["retry_available_at"] is not None:
+        user_data["retry_available_at"] = row["retry_available_at"]
+    if row["remedial_plan"] is not None:
+        user_data["remedial_plan"] = json.loads(row["remedial_plan"])
+    return user_data
 
-def load_user_progress():
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, "r") as f:
-            return json.load(f)
-    return {}
+def write_user_progress(conn, session_id: str, user_data: Dict):
+    """Replaces a session's rows using an open connection (same shape as load_user_progress)."""
+    remedial_plan = user_data.get("remedial_plan")
+    conn.execute(
+        "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            session_id,
+            user_data.get("xp", 0),
+            user_data.get("unlocked_level", 1),
+            user_data.get("current_chapter_index", 0),
+            user_data.get("retry_available_at"),
+            json.dumps(remedial_plan) if remedial_plan is not None else None
+        )
+    )
+    conn.execute("DELETE FROM history WHERE session_id = ?", (session_id,))
+    conn.executemany(
+        "INSERT INTO history (session_id, level, score, max_score, passed, xp_gained, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (session_id, h.get("level"), h.get("score"), h.get("max_score"), h.get("passed"), h.get("xp_gained"), h.get("timestamp"))
+            for h in user_data.get("history", [])
+        ]
+    )
+    conn.execute("DELETE FROM mistakes WHERE session_id = ?", (session_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO mistakes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (session_id, m["question"], m.get("correct_answer"), m.get("explanation"), m.get("user_answer"),
+             m.get("level"), m.get("comments") or "", m.get("timestamp"))
+            for m in user_data.get("mistakes", [])
+        ]
+    )
+
+def read_legacy_progress() -> Dict[str, Dict]:
+    """Reads the older JSON progress stores. Per-session files win over the single legacy file."""
+    progress = {}
+    try:
+        with open(LEGACY_PROGRESS_FILE, "r") as f:
+            legacy = json.load(f)
+        progress.update((sid, data) for sid, data in legacy.items() if isinstance(data, dict))
+    except FileNotFoundError:
+        pass
 
-def save_user_progress(progress):
-    with open(PROGRESS_FILE, "w") as f:
-        json.dump(progress, f, indent=4)
+    try:
+        with os.scandir(PROGRESS_DIR) as entries:
+            shards = [entry for entry in entries if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        shards = []
+    for entry in shards:
+        try:
+            with open(entry.path, "r") as f:
+                progress[entry.name[:-len(".json")]] = json.load(f)
+        except FileNotFoundError:
+            continue
+    return progress
+
+def migrate_json_progress() -> int:
+    """
+    Imports progress from the older JSON stores into SQLite. Sessions already in
+    the database are left alone and the JSON files are not touched, so this is
+    safe to run repeatedly and from several workers. Returns the number imported.
+    """
+    progress = read_legacy_progress()
+    if not progress:
+        return 0
+
+    imported = 0
+    with db.connect(immediate=True) as conn:
+        for sid, data in progress.items():
+            if conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (sid,)).fetchone():
+                continue
+            write_user_progress(conn, sid, data)
+            imported += 1
+    if imported:
+        print(f"📦 Migrated progress for {imported} sessions to {db.DB_PATH}")
+    return imported
 
 def submit_assessment_result(session_id: str, level: int, score: int, max_score: int, mistakes: List[Dict] = None):
-    progress = load_user_progress()
-    
-    if session_id not in progress:
-        progress[session_id] = {
-            "xp": 0, 
-            "unlocked_level": 1, 
-            "current_chapter_index": 0,
-            "history": [], 
-            "mistakes": []
-        }
-    
-    user_data = progress[session_id]
-    
+    ts = str(time.time())
+
     # Validation: Ensure they are submitting for the CORRECT chapter level
     # (Simplified: Frontend handles most checks, backend updates pointers)
-    
-    if "mistakes" not in progress[session_id]:
-        progress[session_id]["mistakes"] = []
-        
-    user_data = progress[session_id]
-    
-    # Calculate XP
-    xp_gained = 0
-    passed = False
-    
-    # Bloom's Logic & Thresholds
-    if level == 1:
-        if score >= 8: 
-            xp_gained = random.randint(50, 100)
-            passed = True
-            if user_data["unlocked_level"] < 2:
-                user_data["unlocked_level"] = 2
-                
+
+    # Lock up front so concurrent submits for a session can't drop each other's updates
+    with db.connect(immediate=True) as conn:
+        conn.execute("INSERT OR IGNORE INTO sessions (session_id) VALUES (?)", (session_id,))
+        user_data = dict(conn.execute(
+            "SELECT xp, unlocked_level, current_chapter_index FROM sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone())
+        attempts = conn.execute(
+            "SELECT COUNT(*) FROM history WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+        # Calculate XP
+        xp_gained = 0
+        passed = False
+        # Seeded per attempt so replaying the same submission grants the same XP
+        rng = random.Random(f"{session_id}:{level}:{attempts}")
+
+        # Bloom's Logic & Thresholds
+        if level == 1:
+            if score >= 8: 
+                xp_gained = rng.randint(50, 100)
+                passed = True
+                if user_data["unlocked_level"] < 2:
+                    user_data["unlocked_level"] = 2
+                    
+        elif level == 2:
+            if score >= 7:
+                xp_gained = rng.randint(100, 150)
+                passed = True
+                if user_data["unlocked_level"] < 3:
+                    user_data["unlocked_level"] = 3
+
+        elif level == 3:
+            if score > 0: # Strict passing for L3
+                xp_gained = rng.randint(150, 200) + 500 # Bonus for Chapter Clear
+                passed = True
                 
-    elif level == 2:
-        if score >= 7:
-            xp_gained = random.randint(100, 150)
-            passed = True
-            if user_data["unlocked_level"] < 3:
-                user_data["unlocked_level"] = 3
-
-    elif level == 3:
-        if score > 0: # Strict passing for L3
-            xp_gained = random.randint(150, 200) + 500 # Bonus for Chapter Clear
-            passed = True
-            
-            # --- CHAPTER MASTERED ---
-            # Move to next chapter, Reset level to 1
-            user_data["current_chapter_index"] = user_data.get("current_chapter_index", 0) + 1
-            user_data["unlocked_level"] = 1 
-
-    if passed:
-        user_data["xp"] += xp_gained
-        # clear remedial plan if passed
-        if "remedial_plan" in user_data:
-            del user_data["remedial_plan"]
-        if "retry_available_at" in user_data:
-            del user_data["retry_available_at"]
-    else:
-        # FAILED - Trigger Cooldown & Remedial Plan
-        user_data["retry_available_at"] = time.time() + COOLDOWN_SECONDS
+                # --- CHAPTER MASTERED ---
+                # Move to next chapter, Reset level to 1
+                user_data["current_chapter_index"] += 1
+                user_data["unlocked_level"] = 1 
+
+        if passed:
+            user_data["xp"] += xp_gained
+            # clear remedial plan if passed
+            conn.execute(
+                """UPDATE sessions SET xp = ?, unlocked_level = ?, current_chapter_index = ?,
+                   remedial_plan = NULL, retry_available_at = NULL WHERE session_id = ?""",
+                (user_data["xp"], user_data["unlocked_level"], user_data["current_chapter_index"], session_id)
+            )
+        else:
+            # FAILED - Trigger Cooldown
+            retry_available_at = time.time() + COOLDOWN_SECONDS
+            conn.execute(
+                "UPDATE sessions SET retry_available_at = ? WHERE session_id = ?",
+                (retry_available_at, session_id)
+            )
+
+        # Update History
+        conn.execute(
+            "INSERT INTO history (session_id, level, score, max_score, passed, xp_gained, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, level, score, max_score, passed, xp_gained, ts)
+        )
+
+        # Update Mistakes (the (session_id, question) key skips duplicates)
         if mistakes:
-            user_data["remedial_plan"] = generate_remedial_plan(mistakes)
-    
-    # Update History
-    user_data["history"].append({
-        "level": level,
-        "score": score,
-        "max_score": max_score,
-        "passed": passed,
-        "xp_gained": xp_gained,
-        "timestamp": str(os.path.getmtime(PROGRESS_FILE) if os.path.exists(PROGRESS_FILE) else 0) 
-    })
-
-    # Update Mistakes
-    if mistakes:
-        for m in mistakes:
-            # Check if mistake already exists to avoid duplicates
-            if not any(dm["question"] == m["question"] for dm in user_data["mistakes"]):
-                user_data["mistakes"].append({
-                    "question": m["question"],
-                    "correct_answer": m.get("correct_answer"),
-                    "explanation": m.get("explanation"),
-                    "user_answer": m.get("user_answer"),
-                    "level": level,
-                    "comments": "",
-                    "timestamp": str(os.path.getmtime(PROGRESS_FILE) if os.path.exists(PROGRESS_FILE) else 0)
-                })
-    
-    save_user_progress(progress)
+            conn.executemany(
+                "INSERT OR IGNORE INTO mistakes VALUES (?, ?, ?, ?, ?, ?, '', ?)",
+                [
+                    (session_id, m["question"], m.get("correct_answer"), m.get("explanation"), m.get("user_answer"), level, ts)
+                    for m in mistakes
+                ]
+            )
+
+    # Remedial Plan is generated outside the transaction so the LLM call doesn't hold the write lock
+    if not passed and mistakes:
+        remedial_plan = generate_remedial_plan(mistakes)
+        # Only attach it if this failure is still the latest attempt; a pass (or newer
+        # failure) that landed while the plan was generating must not be overwritten
+        with db.connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET remedial_plan = ? WHERE session_id = ? AND retry_available_at = ?",
+                (json.dumps(remedial_plan), session_id, retry_available_at)
+            )
     
     return {
         "passed": passed,
@@ -400,40 +643,32 @@ def submit_assessment_result(session_id: str, level: int, score: int, max_score:
     }
 
 def get_mistakes(session_id: str):
-    progress = load_user_progress()
-    if session_id == "all":
-        all_mistakes = []
-        for sid, data in progress.items():
-            if isinstance(data, dict) and "mistakes" in data:
-                # Add session_id to each mistake for context in global view
-                for m in data["mistakes"]:
-                    m_with_sid = m.copy()
-                    m_with_sid["session_id"] = sid
-                    all_mistakes.append(m_with_sid)
-        return all_mistakes
-        
-    if session_id not in progress:
-        return []
-    return progress[session_id].get("mistakes", [])
+    with db.connect() as conn:
+        if session_id == "all":
+            # Add session_id to each mistake for context in global view
+            rows = conn.execute("SELECT * FROM mistakes ORDER BY rowid").fetchall()
+            return [dict(mistake_from_row(row), session_id=row["session_id"]) for row in rows]
+
+        rows = conn.execute(
+            "SELECT * FROM mistakes WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+        return [mistake_from_row(row) for row in rows]
 
 def update_mistake_comment(session_id: str, question_text: str, comment: str):
-    progress = load_user_progress()
-    if session_id in progress and "mistakes" in progress[session_id]:
-        for m in progress[session_id]["mistakes"]:
-            if m["question"] == question_text:
-                m["comments"] = comment
-                save_user_progress(progress)
-                return True
-    return False
+    with db.connect() as conn:
+        cur = conn.execute(
+            "UPDATE mistakes SET comments = ? WHERE session_id = ? AND question = ?",
+            (comment, session_id, question_text)
+        )
+        return cur.rowcount > 0
 
 def get_progress(session_id: str):
-    progress = load_user_progress()
-    user_data = progress.get(session_id, {
+    user_data = load_user_progress(session_id) or {
         "xp": 0, 
         "unlocked_level": 1, 
         "current_chapter_index": 0,
         "history": []
-    })
+    }
     
     # Calculate Lagging Status
     files = get_sorted_files(session_id)
@@ -482,7 +717,7 @@ def get_teacher_analytics(session_id: str):
     For demo purposes, generates synthetic data for 'other students' 
     and blends with the real user's progress.
     """
-    progress = load_user_progress().get(session_id, {})
+    progress = load_user_progress(session_id)
     
     # Real User Data
     user_level = progress.get("unlocked_level", 1)
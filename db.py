@@ -0,0 +1,83 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# --- CONFIG ---
+DB_PATH = os.path.join("data", "app.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    xp INTEGER NOT NULL DEFAULT 0,
+    unlocked_level INTEGER NOT NULL DEFAULT 1,
+    current_chapter_index INTEGER NOT NULL DEFAULT 0,
+    retry_available_at REAL,
+    remedial_plan TEXT
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    level INTEGER,
+    score INTEGER,
+    max_score INTEGER,
+    passed INTEGER,
+    xp_gained INTEGER,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_session ON history (session_id);
+
+CREATE TABLE IF NOT EXISTS mistakes (
+    session_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    correct_answer TEXT,
+    explanation TEXT,
+    user_answer TEXT,
+    level INTEGER,
+    comments TEXT NOT NULL DEFAULT '',
+    timestamp TEXT,
+    PRIMARY KEY (session_id, question)
+);
+
+CREATE TABLE IF NOT EXISTS roadmaps (
+    id TEXT PRIMARY KEY,
+    session_id TEXT,
+    title TEXT,
+    progress REAL,
+    status TEXT,
+    created_at TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_roadmaps_session ON roadmaps (session_id);
+"""
+
+@contextmanager
+def connect(immediate: bool = False):
+    """
+    Opens a connection that commits on success and rolls back on error.
+    With immediate=True the write lock is taken up front, so read-modify-write
+    sequences from concurrent requests are serialized instead of interleaving.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        if immediate:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def init_db():
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    with connect() as conn:
+        # WAL lets readers proceed while a submit is writing; the mode persists in the file
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+init_db()
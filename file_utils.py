@@ -0,0 +1,35 @@
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+from typing import Any
+
+from json_utils import DUMP_KWARGS
+
+@contextmanager
+def atomic_open(path: str, encoding: str = "utf-8"):
+    """
+    Opens a temp file in the same directory as `path` for writing and swaps it
+    into place on success. Readers see either the old or the new file, never a
+    partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def atomic_write_json(path: str, obj: Any):
+    """Atomically writes JSON (compact unless DEBUG_PRETTY_JSON is set)."""
+    with atomic_open(path) as f:
+        json.dump(obj, f, ensure_ascii=False, **DUMP_KWARGS)
+
+def atomic_write_text(path: str, text: str):
+    with atomic_open(path) as f:
+        f.write(text)
@@ -12,6 +12,8 @@ from tenacity import (
     retry_if_exception_type
 )
 from dotenv import load_dotenv
+from file_utils import atomic_write_json
+from json_utils import strip_fences
 
 load_dotenv(override=True)
 
@@ -111,13 +113,12 @@ def generate_flashcards(session_id: str, language: str = "english"):
     
     try:
         # Clean response if AI adds markdown
-        clean_content = response.content.replace('```json', '').replace('```', '').strip()
+        clean_content = strip_fences(response.content)
         data = json.loads(clean_content)
         
         # Cache for future use
         os.makedirs(os.path.dirname(flashcard_cache_path), exist_ok=True)
-        with open(flashcard_cache_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        atomic_write_json(flashcard_cache_path, data)
             
         return data.get("flashcards", [])
     except Exception as e:
@@ -3,6 +3,7 @@ import json
 import re
 from typing import List
 from topic_mapper import group_elements_by_topic
+from json_utils import strip_fences
 from unstructured.partition.pdf import partition_pdf
 from unstructured.chunking.title import chunk_by_title
 from langchain_core.documents import Document
@@ -151,13 +152,8 @@ def create_batch_ai_summaries(batch_contents: List[dict]) -> List[str]:
         try:
             # Request JSON output
             response = llm.invoke([HumanMessage(content=message_content)])
-            content_out = response.content.strip()
-            
             # Strip markdown code blocks if present
-            if content_out.startswith("```json"):
-                content_out = content_out[7:-3].strip()
-            elif content_out.startswith("```"):
-                content_out = content_out[3:-3].strip()
+            content_out = strip_fences(response.content.strip())
                 
             summaries = json.loads(content_out)
             if isinstance(summaries, list) and len(summaries) == len(batch_contents):
@@ -0,0 +1,14 @@
+import os
+import re
+
+# Stored JSON is machine-read, so it is written compactly. Set DEBUG_PRETTY_JSON=1
+# to pretty-print it when inspecting files or database rows by hand.
+PRETTY_JSON = os.getenv("DEBUG_PRETTY_JSON", "").lower() in ("1", "true", "yes")
+DUMP_KWARGS = {"indent": 4} if PRETTY_JSON else {"separators": (",", ":")}
+
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+def strip_fences(text: str) -> str:
+    """Returns the body of a markdown code fence (```json ... ```), or the text unchanged."""
+    m = _FENCE_RE.match(text)
+    return m.group(1) if m else text
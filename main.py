@@ -1,18 +1,16 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Form
-from typing import List
+from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Form, Header
+from typing import List, Dict, Optional
 import os
-import shutil
+import asyncio
+import aiofiles
 import uuid
 import json # Added json import as it's used later in the code
 
-from ingestion_pipeline import ingest_directory
-from retrieval_service import get_doubt_assistant_response
-
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import assessment_service
-import flashcard_service
 import roadmap_service
 
 app = FastAPI()
@@ -31,17 +29,36 @@ app.add_middleware(
 # ----------------------------
 UPLOAD_ROOT = "uploads"
 ALLOWED_EXTENSIONS = {".pdf"}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ROADMAP_JOB_TTL_SECONDS = 300 # Finished roadmap event logs are kept this long for late or reconnecting clients
 
 os.makedirs(UPLOAD_ROOT, exist_ok=True)
 
 app.mount("/uploads", StaticFiles(directory=UPLOAD_ROOT), name="uploads")
 
+@app.on_event("startup")
+async def import_legacy_data():
+    # Idempotent: JSON data from before the SQLite store is imported once, reruns skip it
+    from migrate_data import run_migrations
+    await asyncio.to_thread(run_migrations)
+
 # ----------------------------
 # HELPERS
 # ----------------------------
 def is_allowed_file(filename: str) -> bool:
     return any(filename.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS)
 
+async def save_upload(file: UploadFile, file_path: str):
+    """Streams an upload to disk in chunks without blocking the event loop."""
+    async with aiofiles.open(file_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await out.write(chunk)
+
+def run_ingestion(session_dir: str):
+    # Imported here: ingestion_pipeline loads unstructured, the embedding model and the LLM at import
+    from ingestion_pipeline import ingest_directory
+    ingest_directory(session_dir)
+
 # ----------------------------
 # STATUS ENDPOINTS
 # ----------------------------
@@ -71,6 +88,7 @@ async def ask_question(session_id: str, query: str, language: str = "english", t
     """
     Endpoint for the Doubt Assistant. Supports both RAG (Institution) and General (Individual) tracks.
     """
+    from retrieval_service import get_doubt_assistant_response
     try:
         is_individual = track == "individual"
         response = get_doubt_assistant_response(query, session_id, language, is_individual)
@@ -96,27 +114,36 @@ async def upload_files(
 
     os.makedirs(session_dir, exist_ok=True)
 
-    saved_files = []
+    accepted_files = {}
     rejected_files = []
 
     for file in files:
         if not is_allowed_file(file.filename):
             rejected_files.append(file.filename)
             continue
+        # Same name means same path on disk; keep the last one, as sequential saves did
+        accepted_files[file.filename] = file
 
+    async def save(file: UploadFile) -> str:
         file_path = os.path.join(session_dir, file.filename)
-
         try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            saved_files.append(file.filename)
-
+            await save_upload(file, file_path)
         except Exception as e:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to save file {file.filename}: {str(e)}"
             )
+        return file.filename
+
+    # Save all files concurrently; if one fails, stop the rest before reporting it
+    tasks = [asyncio.create_task(save(file)) for file in accepted_files.values()]
+    try:
+        saved_files = list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
     if not saved_files:
         raise HTTPException(
@@ -126,7 +153,7 @@ async def upload_files(
 
     # Trigger ingestion in background
     try:
-        background_tasks.add_task(ingest_directory, session_dir)
+        background_tasks.add_task(run_ingestion, session_dir)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -172,7 +199,8 @@ async def get_classrooms():
 async def generate_assessment_endpoint(request: AssessmentRequest):
     """Generate or retrieve an assessment for a specific level."""
     from assessment_service import generate_assessment
-    result = generate_assessment(request.session_id, request.level)
+    # Off the event loop: a cold chapter is partitioned before the LLM call
+    result = await asyncio.to_thread(generate_assessment, request.session_id, request.level)
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
@@ -219,8 +247,9 @@ async def get_progress_endpoint(session_id: str):
 @app.get("/api/flashcards/{session_id}")
 async def get_flashcards(session_id: str, language: str = "english"):
     """Get topic-wise revision flashcards with language support."""
+    from flashcard_service import generate_flashcards
     try:
-        cards = flashcard_service.generate_flashcards(session_id, language)
+        cards = generate_flashcards(session_id, language)
         return cards
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -233,22 +262,11 @@ class XPRequest(BaseModel):
 async def add_xp(request: XPRequest):
     """Manually add XP to a student (e.g. for viewing flashcards)."""
     try:
-        progress = assessment_service.load_user_progress()
-        if request.session_id not in progress:
-            # Initialize if not exists
-            progress[request.session_id] = {
-                "xp": 0,
-                "mistakes": [],
-                "history": [],
-                "unlocked_level": 1
-            }
-        
-        progress[request.session_id]["xp"] += request.amount
-        assessment_service.save_user_progress(progress)
+        new_total = assessment_service.add_xp(request.session_id, request.amount)
         
         return {
             "success": True,
-            "new_total": progress[request.session_id]["xp"]
+            "new_total": new_total
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -302,6 +320,110 @@ async def generate_roadmap_endpoint(request: RoadmapGenerateRequest):
         raise HTTPException(status_code=500, detail=result["error"])
     return result
 
+class RoadmapJob:
+    """
+    Append-only event log for one roadmap generation. Every subscriber reads it
+    from its own offset, so concurrent and reconnecting clients all get every event.
+    Only touched from the event loop thread.
+    """
+
+    def __init__(self):
+        self.events: List[str] = []
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def publish(self, event: str, data):
+        self.events.append(sse_event(event, data, len(self.events)))
+        self._wake()
+
+    def finish(self):
+        self.finished = True
+        self._wake()
+
+    def _wake(self):
+        # Swap in a fresh Event so waiters that already woke don't spin on a set one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self, offset: int = 0):
+        while True:
+            while offset < len(self.events):
+                yield self.events[offset]
+                offset += 1
+            if self.finished:
+                return
+            await self._changed.wait()
+
+roadmap_jobs: Dict[str, RoadmapJob] = {}
+roadmap_tasks = set()
+
+def sse_event(event: str, data, event_id: Optional[int] = None) -> str:
+    # JSON-encode so chunks containing newlines stay on a single data line
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def run_roadmap_job(roadmap_id: str, prompt: str, session_id: str, job: RoadmapJob):
+    loop = asyncio.get_running_loop()
+
+    def on_chunk(text: str):
+        # Called from the worker thread
+        loop.call_soon_threadsafe(job.publish, "chunk", text)
+
+    try:
+        result = await asyncio.to_thread(
+            roadmap_service.generate_roadmap, prompt, session_id, roadmap_id, on_chunk
+        )
+        if "error" in result:
+            job.publish("error", result["error"])
+        else:
+            job.publish("done", result)
+    except Exception as e:
+        job.publish("error", str(e))
+    finally:
+        # Chunks scheduled by the worker thread run before this callback, so finish() is last
+        loop.call_soon(job.finish)
+        loop.call_later(ROADMAP_JOB_TTL_SECONDS, roadmap_jobs.pop, roadmap_id, None)
+
+@app.post("/api/roadmap/generate_stream")
+async def generate_roadmap_stream_endpoint(request: RoadmapGenerateRequest):
+    """Start roadmap generation in the background; follow it via /api/roadmap/{id}/stream."""
+    roadmap_id = str(uuid.uuid4())
+    job = RoadmapJob()
+    roadmap_jobs[roadmap_id] = job
+
+    task = asyncio.create_task(run_roadmap_job(roadmap_id, request.prompt, request.session_id, job))
+    roadmap_tasks.add(task)
+    task.add_done_callback(roadmap_tasks.discard)
+
+    return {
+        "id": roadmap_id,
+        "status": "processing",
+        "stream_url": f"/api/roadmap/{roadmap_id}/stream"
+    }
+
+@app.get("/api/roadmap/{roadmap_id}/stream")
+async def stream_roadmap_endpoint(roadmap_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events for a roadmap being generated: `chunk` events carry raw
+    JSON text as it arrives, then a final `done` (full roadmap) or `error` event.
+    Any number of clients may follow the same roadmap; reconnecting clients resume
+    after their Last-Event-ID.
+    """
+    headers = {"Cache-Control": "no-cache"}
+    job = roadmap_jobs.get(roadmap_id)
+    if job is None:
+        # Finished longer than ROADMAP_JOB_TTL_SECONDS ago: send the saved roadmap
+        roadmap = roadmap_service.get_roadmap(roadmap_id)
+        if not roadmap:
+            raise HTTPException(status_code=404, detail="Roadmap not found")
+
+        async def finished_events():
+            yield sse_event("done", roadmap)
+        return StreamingResponse(finished_events(), media_type="text/event-stream", headers=headers)
+
+    offset = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(job.subscribe(offset), media_type="text/event-stream", headers=headers)
+
 @app.get("/api/roadmaps/{session_id}")
 async def list_roadmaps_endpoint(session_id: str):
     """List all roadmaps for a user/session."""
@@ -387,14 +509,13 @@ async def upload_review(
     if file:
         file_path = os.path.join(session_dir, "teacher_review_document.pdf")
         try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            await save_upload(file, file_path)
             
             review_data["has_document"] = True
             review_data["document_path"] = file_path
             
             # Trigger ingestion for RAG
-            background_tasks.add_task(ingest_directory, session_dir)
+            background_tasks.add_task(run_ingestion, session_dir)
             
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save review document: {str(e)}")
@@ -0,0 +1,22 @@
+"""
+Imports data from the pre-SQLite JSON stores (data/user_progress.json,
+data/progress/, data/roadmaps/) into data/app.db.
+
+Runs on app startup and can also be run by hand:
+
+    python migrate_data.py
+
+Existing database rows are never overwritten and the JSON files are left in
+place, so running it again (or from several workers at once) is harmless.
+"""
+import assessment_service
+import roadmap_service
+
+def run_migrations():
+    sessions = assessment_service.migrate_json_progress()
+    roadmaps = roadmap_service.migrate_json_roadmaps()
+    return {"sessions": sessions, "roadmaps": roadmaps}
+
+if __name__ == "__main__":
+    result = run_migrations()
+    print(f"✅ Migration done: {result['sessions']} sessions, {result['roadmaps']} roadmaps imported")
@@ -0,0 +1,21 @@
+import os
+
+# Runs inside the PDF worker processes. Kept free of app imports so spawned
+# workers don't re-run assessment_service's setup (DB init, dotenv, pypdf).
+
+def init_worker():
+    """Imports unstructured once per worker instead of on every task."""
+    try:
+        import unstructured.partition.pdf  # noqa: F401
+    except Exception as e:
+        print(f"⚠️ PDF worker could not preload unstructured: {e}")
+
+def partition_pdf_text(file_path: str) -> str:
+    """Partitions a single PDF (fast strategy) and returns its text."""
+    try:
+        from unstructured.partition.pdf import partition_pdf
+        elements = partition_pdf(filename=file_path, strategy="fast")
+        return "\n".join([str(e) for e in elements])
+    except Exception as e:
+        print(f"Error parsing {os.path.basename(file_path)}: {e}")
+        return ""
@@ -1,13 +1,18 @@
+import io
+import re
 import json
+import ijson
 from json_repair import repair_json
 import os
 
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
+from json_utils import strip_fences, DUMP_KWARGS
+import db
 
 load_dotenv()
 
@@ -19,12 +24,109 @@ if not api_key:
 
 client = genai.Client(api_key=api_key)
 
-ROADMAPS_DIR = os.path.join("data", "roadmaps")
-os.makedirs(ROADMAPS_DIR, exist_ok=True)
+ROADMAPS_DIR = os.path.join("data", "roadmaps") # Pre-SQLite roadmap files, imported by migrate_data.py
 
-def generate_roadmap(prompt: str, session_id: str) -> Dict[str, Any]:
+# Opening fence plus optional language tag, e.g. ```json
+_OPENING_FENCE_RE = re.compile(r"```[\w-]*")
+_FENCE_TAIL_CHARS = "` \t\r\n"
+
+def stream_to_buffer(
+    contents: str,
+    config: types.GenerateContentConfig,
+    on_chunk: Optional[Callable[[str], None]] = None
+) -> io.BytesIO:
+    """
+    Streams a Gemini response into a byte buffer, dropping markdown code fences
+    as they arrive so the buffer can be fed straight to ijson. Each cleaned
+    chunk is also passed to `on_chunk`, if given.
+
+    Fences may be split across chunks, so leading text is held until it is past
+    any opening fence, and trailing backticks/whitespace are held until more
+    text follows (or dropped at the end if they close the fence).
+    """
+    buffer = io.BytesIO()
+
+    def emit(text: str):
+        buffer.write(text.encode("utf-8"))
+        if on_chunk:
+            on_chunk(text)
+
+    head = ""  # Leading text not yet written
+    started = False
+    fence_checked = False
+    held = ""  # Possible closing fence
+
+    for chunk in client.models.generate_content_stream(
+        model='gemini-2.0-flash',
+        contents=contents,
+        config=config
+    ):
+        text = chunk.text or ""
+        if not started:
+            head = (head + text).lstrip()
+            if not fence_checked:
+                fence = _OPENING_FENCE_RE.match(head)
+                if "```".startswith(head) or (fence and fence.end() == len(head)):
+                    continue # Could still be (part of) an opening fence or its language tag
+                if fence:
+                    head = head[fence.end():].lstrip()
+                fence_checked = True
+            if not head:
+                continue
+            text, head, started = head, "", True
+
+        text = held + text
+        body = text.rstrip(_FENCE_TAIL_CHARS)
+        held = text[len(body):]
+        if body:
+            emit(body)
+
+    tail = held.rstrip()
+    if tail.endswith("```"):
+        tail = tail[:-3].rstrip()
+    if tail:
+        emit(tail)
+
+    buffer.seek(0)
+    return buffer
+
+def parse_json_buffer(buffer: io.BytesIO, is_array: bool = False) -> Any:
+    """
+    Parses a JSON object (or array) incrementally with ijson.
+    Falls back to json_repair on the full text only when the stream is malformed.
+    """
+    preview = buffer.getbuffer()[:100].tobytes().decode("utf-8", errors="replace")
+    print(f"✅ AI Response received: {preview}...")
+
+    try:
+        if is_array:
+            data = list(ijson.items(buffer, "item", use_float=True))
+        else:
+            data = dict(ijson.kvitems(buffer, "", use_float=True))
+        if data:
+            return data
+    except ijson.JSONError as stream_err:
+        print(f"⚠️ Streaming JSON parse failed, repairing: {stream_err}")
+
+    text = strip_fences(buffer.getvalue().decode("utf-8", errors="replace"))
+    try:
+        # Let json_repair handle it directly, returning a Python object
+        return json.loads(repair_json(text))
+    except Exception as parse_err:
+        print(f"❌ Critical JSON parsing failure even after repair: {parse_err}")
+        print(f"Raw text generated: {text}")
+        raise ValueError(f"Failed to parse AI response: {parse_err}")
+
+def generate_roadmap(
+    prompt: str,
+    session_id: str,
+    roadmap_id: Optional[str] = None,
+    on_chunk: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
     """
     Generates a structured learning roadmap from a user prompt.
+    Raw response chunks are forwarded to `on_chunk` as they stream in
+    (nothing is streamed when the response comes from the cache).
     """
     system_prompt = """
     You are an expert educational consultant. Your task is to create a detailed, high-quality learning roadmap based on a user's goal.
@@ -80,36 +182,18 @@ def generate_roadmap(prompt: str, session_id: str) -> Dict[str, Any]:
     
     print(f"🚀 Generating roadmap for prompt: {prompt}")
     try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=f"{system_prompt}\n\nUser Goal: {prompt}",
-            config=types.GenerateContentConfig(
+        contents = f"{system_prompt}\n\nUser Goal: {prompt}"
+        buffer = stream_to_buffer(
+            contents,
+            types.GenerateContentConfig(
                 tools=[types.Tool(google_search=types.GoogleSearch())]
-            )
+            ),
+            on_chunk
         )
-        
-        # Clean up the response text - remove markdown code blocks if necessary
-        text = response.text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        print(f"✅ AI Response received: {text[:100]}...")
-        
-        try:
-            # Let json_repair handle it directly, returning a Python object
-            roadmap_data = json.loads(repair_json(text))
-        except Exception as parse_err:
-            print(f"❌ Critical JSON parsing failure even after repair: {parse_err}")
-            print(f"Raw text generated: {text}")
-            return {"error": f"Failed to parse AI response: {parse_err}"}
+        roadmap_data = parse_json_buffer(buffer)
 
-        roadmap_id = str(uuid.uuid4())
-        
         # Add metadata
-        roadmap_data["id"] = roadmap_id
+        roadmap_data["id"] = roadmap_id or str(uuid.uuid4())
         roadmap_data["session_id"] = session_id
         roadmap_data["created_at"] = datetime.now().isoformat()
         roadmap_data["status"] = "active"
@@ -124,33 +208,61 @@ def generate_roadmap(prompt: str, session_id: str) -> Dict[str, Any]:
         print(f"Error generating roadmap: {e}")
         return {"error": str(e)}
 
-def save_roadmap(roadmap: Dict[str, Any]):
-    file_path = os.path.join(ROADMAPS_DIR, f"{roadmap['id']}.json")
-    with open(file_path, "w") as f:
-        json.dump(roadmap, f, indent=4)
+def save_roadmap(roadmap: Dict[str, Any], overwrite: bool = True) -> bool:
+    """Stores a roadmap. With overwrite=False an existing row is kept. Returns True if written."""
+    verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+    with db.connect() as conn:
+        cur = conn.execute(
+            f"{verb} INTO roadmaps VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                roadmap["id"],
+                roadmap.get("session_id"),
+                roadmap.get("title"),
+                roadmap.get("progress_percentage", 0),
+                roadmap.get("status"),
+                roadmap.get("created_at"),
+                json.dumps(roadmap, ensure_ascii=False, **DUMP_KWARGS)
+            )
+        )
+        return cur.rowcount > 0
 
 def get_roadmap(roadmap_id: str) -> Optional[Dict[str, Any]]:
-    file_path = os.path.join(ROADMAPS_DIR, f"{roadmap_id}.json")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
-    return None
+    with db.connect() as conn:
+        row = conn.execute("SELECT body FROM roadmaps WHERE id = ?", (roadmap_id,)).fetchone()
+    return json.loads(row["body"]) if row else None
 
 def list_roadmaps(session_id: str) -> List[Dict[str, Any]]:
-    roadmaps = []
-    for filename in os.listdir(ROADMAPS_DIR):
-        if filename.endswith(".json"):
-            with open(os.path.join(ROADMAPS_DIR, filename), "r") as f:
-                data = json.load(f)
-                if data.get("session_id") == session_id:
-                    roadmaps.append({
-                        "id": data["id"],
-                        "title": data["title"],
-                        "progress": data["progress_percentage"],
-                        "status": data["status"],
-                        "created_at": data["created_at"]
-                    })
-    return roadmaps
+    with db.connect() as conn:
+        rows = conn.execute(
+            "SELECT id, title, progress, status, created_at FROM roadmaps WHERE session_id = ? ORDER BY created_at",
+            (session_id,)
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def migrate_json_roadmaps() -> int:
+    """
+    Imports roadmap JSON files from before the SQLite store. Roadmaps already in
+    the database win and the files are left in place, so reruns are harmless.
+    Returns the number imported.
+    """
+    try:
+        with os.scandir(ROADMAPS_DIR) as entries:
+            files = [entry.path for entry in entries if entry.name.endswith(".json")]
+    except FileNotFoundError:
+        return 0
+
+    imported = 0
+    for path in files:
+        try:
+            with open(path, "r") as f:
+                roadmap = json.load(f)
+        except FileNotFoundError:
+            continue
+        if save_roadmap(roadmap, overwrite=False):
+            imported += 1
+    if imported:
+        print(f"📦 Migrated {imported} roadmaps to {db.DB_PATH}")
+    return imported
 
 def generate_week_content(roadmap_id: str, week_number: int):
     roadmap = get_roadmap(roadmap_id)
@@ -188,22 +300,16 @@ def generate_week_content(roadmap_id: str, week_number: int):
     """
 
     try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=f"{system_prompt}\n\nRoadmap Title: {roadmap['title']}\nWeek {week_number} Outline:\n{context_str}",
-            config=types.GenerateContentConfig(
+        buffer = stream_to_buffer(
+            f"{system_prompt}\n\nRoadmap Title: {roadmap['title']}\nWeek {week_number} Outline:\n{context_str}",
+            types.GenerateContentConfig(
                 tools=[types.Tool(google_search=types.GoogleSearch())],
                 response_mime_type="application/json"
             )
         )
         
-        text = response.text.strip()
-        # Clean up possible markdown
-        if text.startswith("```json"): text = text[7:]
-        if text.endswith("```"): text = text[:-3]
-        
         try:
-            new_days_data = json.loads(repair_json(text))
+            new_days_data = parse_json_buffer(buffer, is_array=True)
             
             # Update the roadmap object
             for i, day in enumerate(target_week["days"]):